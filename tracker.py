@@ -1,3 +1,6 @@
+import logging
+from collections import deque
+
 import numpy as np
 
 try:
@@ -5,6 +8,39 @@ try:
 except ModuleNotFoundError:
     from kalman_filter_new import KalmanFilter
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+try:
+    # optional C++ Jonker-Volgenant solver, considerably faster than scipy
+    # on the dense assignment problems produced here
+    from lap import lapjv
+except ModuleNotFoundError:
+    lapjv = None
+
+try:
+    # optional JIT compilation of the cost kernel (see KalmanFilter kernels):
+    # the explicit pair loop below compiles to vectorized machine code
+    # specialized for the fixed coordinate dtype
+    from numba import njit
+except ModuleNotFoundError:
+    njit = None
+
+log = logging.getLogger(__name__)
+
+
+def _sq_dist_into(track_xy, det_xy, out):
+    for i in range(track_xy.shape[0]):
+        t_x = track_xy[i, 0]
+        t_y = track_xy[i, 1]
+        for j in range(det_xy.shape[0]):
+            d_x = t_x - det_xy[j, 0]
+            d_y = t_y - det_xy[j, 1]
+            out[i, j] = d_x * d_x + d_y * d_y
+
+
+if njit is not None:
+    _sq_dist_into = njit(cache=True)(_sq_dist_into)
 
 
 class Track(object):
@@ -18,7 +54,9 @@ class Track(object):
                  std_acc=5, y_std_meas=0.1, x_std_meas=0.1,
                  predicted_class=None,
                  bbox=[None, None, None, None],
-                 known_id=-1):
+                 known_id=-1,
+                 max_trace_length=None,
+                 kf=None):
         """
         Initialise individual track
         :param prediction: [x,y] coordinates of input (detection)
@@ -32,19 +70,30 @@ class Track(object):
         :param prediction: initial location [x,y] of track
         :param bbox: bounding box of detection
         :param known_id: assigned ID, when initialising from a prior tracker state
+        :param max_trace_length: number of past detections retained in the trace (None for unbounded)
+        :param kf: recycled KalmanFilter instance to reset and reuse instead of building a new one
         """
         if known_id != -1:
             self.track_id = known_id  # use previous ID, when initialising from prior tracked state
         else:
             self.track_id = trackIdCount  # identification of each track object
-        self.KF = KalmanFilter(dt=dt, u_x=u_x, u_y=u_y,
-                               std_acc=std_acc, y_std_meas=y_std_meas, x_std_meas=x_std_meas,
-                               initial_state=prediction)  # KF instance to track this object
-        self.prediction = np.asarray(prediction)  # predicted centroids (x,y)
-        self.skipped_frames = 0  # number of frames skipped undetected
-        self.trace = []  # trace path
-        if any(bbox) is not None:
-            self.bbox_trace = [bbox]  # trace bounding boxes
+        if kf is not None:
+            kf.reset(prediction)
+            self.KF = kf  # recycled KF instance to track this object
+        else:
+            self.KF = KalmanFilter(dt=dt, u_x=u_x, u_y=u_y,
+                                   std_acc=std_acc, y_std_meas=y_std_meas, x_std_meas=x_std_meas,
+                                   initial_state=prediction)  # KF instance to track this object
+        # per-track state lives in the Tracker's contiguous arrays once the track is registered
+        # (see Tracker._append_track). Until then, fall back to local storage.
+        self._tracker = None
+        self._slot = -1
+        self._prediction = np.asarray(prediction, dtype=np.float32).reshape(-1)[:2]  # predicted centroids (x,y)
+        self._skipped_frames = 0  # number of frames skipped undetected
+        # traces are bounded deques, so appends evict the oldest entry in O(1)
+        # instead of requiring explicit trimming
+        self.trace = deque(maxlen=max_trace_length)  # trace path
+        self.bbox_trace = deque([bbox], maxlen=max_trace_length)  # trace bounding boxes
         if predicted_class is not None:
             # we create a list of predicted classes for each frame, so when terminating the track,
             # we can perform a majority vote to determine the most likely class.
@@ -52,6 +101,35 @@ class Track(object):
             # function when linking detections to existing tracks.
             self.predicted_class = [predicted_class]
 
+    @property
+    def prediction(self):
+        """Predicted centroid (x,y) as a flat (2,) array, viewing the Tracker's state arrays"""
+        if self._tracker is not None:
+            return self._tracker._pred_xy[self._slot]
+        return self._prediction
+
+    @prediction.setter
+    def prediction(self, value):
+        xy = np.asarray(value, dtype=np.float32).reshape(-1)[:2]
+        if self._tracker is not None:
+            self._tracker._pred_xy[self._slot] = xy
+        else:
+            self._prediction = xy
+
+    @property
+    def skipped_frames(self):
+        """Number of frames skipped undetected, viewing the Tracker's state arrays"""
+        if self._tracker is not None:
+            return int(self._tracker._skipped[self._slot])
+        return self._skipped_frames
+
+    @skipped_frames.setter
+    def skipped_frames(self, value):
+        if self._tracker is not None:
+            self._tracker._skipped[self._slot] = value
+        else:
+            self._skipped_frames = value
+
 
 class Tracker(object):
     """
@@ -78,6 +156,9 @@ class Tracker(object):
         :param y_std_meas: standard deviation of the measurement in y-direction
         """
         self.dist_thresh = dist_thresh
+        # the cost matrix holds squared distances, so matches are gated against
+        # the squared threshold (precomputed once here)
+        self._dist_thresh_sq = dist_thresh ** 2
         self.max_frames_to_skip = max_frames_to_skip
         self.max_trace_length = max_trace_length
         self.tracks = []
@@ -89,6 +170,170 @@ class Tracker(object):
         self.std_acc = std_acc
         self.y_std_meas = y_std_meas
         self.x_std_meas = x_std_meas
+        # Struct-of-Arrays track state: one contiguous row / entry per registered track,
+        # grown geometrically as tracks are appended. Track.prediction and
+        # Track.skipped_frames are views into these arrays. Positions are float32
+        # throughout - centroids only need pixel-level precision, and the smaller
+        # dtype halves the memory traffic of the cost kernel.
+        self._capacity = 16
+        self._pred_xy = np.zeros((self._capacity, 2), dtype=np.float32)
+        self._skipped = np.zeros(self._capacity, dtype=np.int32)
+        # reusable cost matrix buffer, reallocated only when (N,M) changes
+        self._cost_buf = None
+        # freelist of KalmanFilter instances recycled from deleted tracks; all
+        # tracker-created filters share the same parameters, so a reset instance
+        # is interchangeable with a freshly constructed one
+        self._kf_pool = []
+
+    def _grow(self, n):
+        """
+        Grow the per-track state arrays to hold at least n tracks
+        :param n: required number of track slots
+        """
+        if self._capacity >= n:
+            return
+        capacity = self._capacity
+        while capacity < n:
+            capacity *= 2
+        self._pred_xy = np.resize(self._pred_xy, (capacity, 2))
+        self._skipped = np.resize(self._skipped, capacity)
+        self._capacity = capacity
+
+    def _append_track(self, track):
+        """
+        Register a new track and bind its state to the Tracker's per-track arrays
+        :param track: Track instance to append
+        """
+        slot = len(self.tracks)
+        if slot + 1 > self._capacity:
+            self._grow(slot + 1)
+        self._pred_xy[slot] = track._prediction
+        self._skipped[slot] = track._skipped_frames
+        track._tracker = self
+        track._slot = slot
+        self.tracks.append(track)
+
+    def _compact_tracks(self):
+        """
+        Re-pack the per-track state arrays after tracks have been deleted from self.tracks
+        """
+        old_slots = [track._slot for track in self.tracks]
+        n = len(old_slots)
+        self._pred_xy[:n] = self._pred_xy[old_slots]
+        self._skipped[:n] = self._skipped[old_slots]
+        for slot, track in enumerate(self.tracks):
+            track._slot = slot
+
+    def _start_new_tracks(self, det_indices, detections, predicted_classes, bounding_boxes,
+                          use_class, use_bbox):
+        """
+        Start one new track per given detection index, growing the per-track state
+        arrays once for the whole batch
+        :param det_indices: indices into detections to seed new tracks from
+        :param detections: list of darknet detection centres from current frame
+        :param predicted_classes: predicted classes from darknet detections
+        :param bounding_boxes: predicted bounding boxes from darknet detections
+        :param use_class: whether predicted class info was provided
+        :param use_bbox: whether bounding box info was provided
+        """
+        self._grow(len(self.tracks) + len(det_indices))
+        for i in det_indices:
+            kf = self._kf_pool.pop() if len(self._kf_pool) > 0 else None
+            if use_class and use_bbox:
+                track = Track(detections[i], self.trackIdCount,
+                              dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
+                              y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas,
+                              predicted_class=predicted_classes[i],
+                              bbox=bounding_boxes[i],
+                              max_trace_length=self.max_trace_length,
+                              kf=kf)
+            else:
+                track = Track(detections[i], self.trackIdCount,
+                              dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
+                              y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas,
+                              max_trace_length=self.max_trace_length,
+                              kf=kf)
+            self.trackIdCount += 1
+            self._append_track(track)
+            log.debug("Started new track: %d", track.track_id)
+
+    def _squared_distances(self, track_xy, det_xy):
+        """
+        Compute the squared euclidean distance between every track prediction and every
+        detection, written in-place into a cost buffer that is reused across frames.
+        The number of tracks and detections is typically stable between consecutive
+        frames, so in the common case no allocation happens at all.
+        :param track_xy: (N,2) array of predicted track centroids
+        :param det_xy: (M,2) array of detection centroids
+        :return: (N,M) cost matrix of squared distances (a view of the shared buffer)
+        """
+        N = track_xy.shape[0]
+        M = det_xy.shape[0]
+        if self._cost_buf is None or self._cost_buf.shape != (N, M):
+            self._cost_buf = np.empty((N, M), dtype=np.float32)
+        cost = self._cost_buf
+        if njit is not None:
+            # compiled pair loop: fused subtract/multiply/add with no temporaries
+            _sq_dist_into(track_xy, det_xy, cost)
+        else:
+            # |t - d|^2 = |t|^2 - 2*t.d + |d|^2, evaluated as one BLAS-backed
+            # matrix product plus two broadcast additions
+            np.dot(track_xy, det_xy.T, out=cost)
+            cost *= -2.0
+            cost += np.einsum("ij,ij->i", track_xy, track_xy)[:, np.newaxis]
+            cost += np.einsum("ij,ij->i", det_xy, det_xy)[np.newaxis, :]
+        return cost
+
+    def _assign_detections(self, cost):
+        """
+        Solve the linear assignment problem for the given track x detection cost matrix,
+        dropping matches whose squared distance exceeds the cost distance threshold.
+        Uses lap's Jonker-Volgenant solver when available and falls back to scipy otherwise.
+        :param cost: (N,M) matrix of squared distances between track predictions and detections
+        :return: (N,) int array mapping each track to its matched detection index, or -1 if unmatched
+        """
+        N, M = cost.shape
+        assignment = np.full(N, -1, dtype=np.int32)
+        if N == 0 or M == 0:
+            return assignment
+
+        if lapjv is not None:
+            # lapjv folds the distance gating into the solve via cost_limit
+            # (lap operates on doubles, so the float32 cost is widened here)
+            _, row_to_col, _ = lapjv(np.ascontiguousarray(cost, dtype=np.float64),
+                                     extend_cost=True, cost_limit=self._dist_thresh_sq)
+            assignment[:] = row_to_col
+            return assignment
+
+        # Pairs beyond the distance threshold can never be matched, so the cost matrix
+        # is effectively sparse whenever tracks and detections are well separated.
+        # In that regime the sparse matcher scales with the number of viable edges
+        # rather than with the full N x M problem.
+        viable = cost <= self._dist_thresh_sq
+        n_edges = np.count_nonzero(viable)
+        if n_edges == 0:
+            return assignment
+        if n_edges < 0.5 * N * M:
+            rows, cols = np.nonzero(viable)
+            # shift all edge weights by +1 so zero-distance edges are kept as explicit
+            # entries; a constant shift leaves the optimal matching unchanged
+            graph = csr_matrix((cost[rows, cols] + 1.0, (rows, cols)), shape=(N, M))
+            try:
+                row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+                assignment[row_ind] = col_ind
+                return assignment
+            except ValueError:
+                # no full matching of the smaller side exists within the viable edges
+                # (e.g. a track with no detection in reach) - solve densely instead
+                pass
+
+        # linear_sum_assignment handles the rectangular N x M case directly, so instead of
+        # padding the matrix with placeholder columns, matches above the distance threshold
+        # are dropped afterwards to avoid forced incorrect matches
+        row_ind, col_ind = linear_sum_assignment(cost)
+        within_reach = cost[row_ind, col_ind] <= self._dist_thresh_sq
+        assignment[row_ind[within_reach]] = col_ind[within_reach]
+        return assignment
 
     def initialise_from_prior_state(self, prior_state):
         """
@@ -101,9 +346,10 @@ class Tracker(object):
                       dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
                       y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas,
                       predicted_class=prior_state[3],
-                      bbox=prior_state[4])
+                      bbox=prior_state[4],
+                      max_trace_length=self.max_trace_length)
         self.trackIdCount += 1
-        self.tracks.append(track)
+        self._append_track(track)
 
     def set_trackIdCount(self, latest_trackid):
         """
@@ -136,119 +382,96 @@ class Tracker(object):
                                (in the same order as theirs respective detections)
         """
 
-        # Create tracks if no tracks vector was found
-        if len(self.tracks) == 0:
-            for i in range(len(detections)):
-                track = Track(detections[i], self.trackIdCount,
-                              dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
-                              y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas,
-                              predicted_class=predicted_classes[i],
-                              bbox=bounding_boxes[i])
-                self.trackIdCount += 1
-                self.tracks.append(track)
+        # evaluate once whether class / bounding box info was provided,
+        # instead of re-checking the input lists for every track below
+        use_class = predicted_classes is not None
+        use_bbox = bounding_boxes is not None and any(b is not None for b in bounding_boxes)
 
-        # Calculate cost using euclidean distance between
-        # predicted vs detected centroids
-        N = len(self.tracks)
         M = len(detections)
-        cost = np.zeros(shape=(N, M))  # Cost matrix
-
-        for i in range(N):
-            for j in range(len(detections)):
-                diff = self.tracks[i].prediction[:2] - detections[j]
-                distance = np.sqrt(diff[0][0] * diff[0][0] +
-                                   diff[1][0] * diff[1][0])
-                cost[i][j] = distance
-
-        # add columns equal to the number of tracks, so that if a track cannot be assigned to
-        # a detection, it is instead assigned to a placeholder instead to avoid forced incorrect matches.
-        # This step also removes the need to filter for "unmatchable" tracks due to large distances
-        cost = np.c_[cost, np.ones((N, N)) * self.dist_thresh]
+        det_xy = np.asarray(detections, dtype=np.float32).reshape(M, 2)
 
-        # Use hungarian algorithm to find likely matches, minimising cost
-        assignment = []
-        for _ in range(N):
-            assignment.append(-1)
-
-        row_ind, col_ind = linear_sum_assignment(cost)
+        if len(self.tracks) == 0:
+            # Create tracks if no tracks vector was found. Every detection seeds its
+            # own track, so the matching below is the identity and the cost matrix
+            # and solver can be skipped entirely for this frame.
+            self._start_new_tracks(range(M), detections, predicted_classes, bounding_boxes,
+                                   use_class, use_bbox)
+            N = M
+            cost = None
+            assignment = np.arange(M, dtype=np.int32)
+        elif M == 0:
+            # No detections in this frame (e.g. full occlusion) - every track goes
+            # unassigned, so the cost matrix and solver are skipped entirely and the
+            # buffer-and-recover handling below takes over.
+            N = len(self.tracks)
+            cost = None
+            assignment = np.full(N, -1, dtype=np.int32)
+        else:
+            # Calculate cost using the squared euclidean distance between
+            # predicted vs detected centroids. As the assignment is invariant under sqrt,
+            # squared distances rank matches identically while avoiding N*M sqrt calls.
+            N = len(self.tracks)
+            cost = self._squared_distances(self._pred_xy[:N], det_xy)  # Cost matrix
 
-        for i in range(len(col_ind)):
-            # lowest cost along the diagonal
-            assignment[i] = col_ind[i]
+            # Find likely matches, minimising cost.
+            # assignment[i] holds the detection index matched to track i, or -1 if unmatched
+            assignment = self._assign_detections(cost)
 
         # Identify tracks with no assignment, if any
-        un_assigned_tracks = []
-        for i in range(N):
-            if assignment[i] == -1 or assignment[i] >= M:
-                # check for cost distance threshold.
-                # If cost is very high then un_assign (delete) the track
-                print("cost to assign", i, "is =", cost[i][assignment[i]])
-                assignment[i] = -1
-                un_assigned_tracks.append(i)
-                self.tracks[i].skipped_frames += 1
-                print("Track", i, "has been invisible for", self.tracks[i].skipped_frames, "frames!")
-
-        print("Unassigned tracks:", un_assigned_tracks, "\n")
-
-        # If tracks are not detected for a long time, remove them
-        del_tracks = []
-        for i in range(N):
-            if self.tracks[i].skipped_frames > self.max_frames_to_skip:
-                del_tracks.append(i)
-
-        if len(del_tracks) > 0:  # only when skipped frames exceeds max
-            for id in del_tracks:
-                if id < len(self.tracks):
-                    print("\n!!!! Deleted track:", self.tracks[id].track_id, "\n !!!!")
-                    del self.tracks[id]
-                    del assignment[id]
-                else:
-                    print("something unexpected assignment error...")
+        # tracks without a detection within the cost distance threshold remain unassigned
+        un_assigned_tracks = [i for i in range(N) if assignment[i] == -1]
+
+        if len(un_assigned_tracks) > 0:
+            self._skipped[un_assigned_tracks] += 1
+            if log.isEnabledFor(logging.DEBUG):
+                for i in un_assigned_tracks:
+                    log.debug("Track %d has been invisible for %d frames!", i, self._skipped[i])
+
+        log.debug("Unassigned tracks: %s", un_assigned_tracks)
+
+        # If tracks are not detected for a long time, remove them.
+        # Deleting via a keep mask drops all stale tracks in one pass and keeps the
+        # remaining track indices, the assignment vector and the state arrays in sync.
+        keep = self._skipped[:N] <= self.max_frames_to_skip
+        if not keep.all():
+            if log.isEnabledFor(logging.DEBUG):
+                for i in np.flatnonzero(~keep):
+                    log.debug("Deleted track: %d", self.tracks[i].track_id)
+            # recycle the deleted tracks' filters instead of letting them be GC'd
+            self._kf_pool.extend(track.KF for track, keep_track in zip(self.tracks, keep)
+                                 if not keep_track)
+            self.tracks = [track for track, keep_track in zip(self.tracks, keep) if keep_track]
+            assignment = assignment[keep]
+            self._compact_tracks()
 
         # Now look for un_assigned detects
-        un_assigned_detects = []
-        for i in range(M):
-            if i not in assignment:
-                un_assigned_detects.append(i)
+        assigned_mask = np.zeros(M, dtype=bool)
+        assigned_mask[assignment[assignment >= 0]] = True
+        un_assigned_detects = np.flatnonzero(~assigned_mask)
 
         # Start new tracks
         if len(un_assigned_detects) != 0:
-            for i in range(len(un_assigned_detects)):
-                if predicted_classes is not None and any(bounding_boxes) is not None:
-                    track = Track(detections[un_assigned_detects[i]],
-                                  self.trackIdCount,
-                                  dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
-                                  y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas,
-                                  predicted_class=predicted_classes[un_assigned_detects[i]],
-                                  bbox=bounding_boxes[un_assigned_detects[i]])
-                else:
-                    track = Track(detections[un_assigned_detects[i]],
-                                  self.trackIdCount,
-                                  dt=self.dt, u_x=self.u_x, u_y=self.u_y, std_acc=self.std_acc,
-                                  y_std_meas=self.y_std_meas, x_std_meas=self.x_std_meas)
-                self.trackIdCount += 1
-                self.tracks.append(track)
-                assignment.append(-1)
-                print("Started new track:", self.tracks[-1].track_id)
+            self._start_new_tracks(un_assigned_detects, detections, predicted_classes,
+                                   bounding_boxes, use_class, use_bbox)
+            assignment = np.append(assignment, np.full(len(un_assigned_detects), -1, dtype=np.int32))
 
-        print("Number of detections M:   ", len(detections))
-        print("Number of Tracks N:       ", len(self.tracks))
-        print("Shape of cost matrix C: ", cost.shape)
-
-        print("\nAssignment vector:        ", assignment, "\n")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Number of detections M: %d", len(detections))
+            log.debug("Number of Tracks N: %d", len(self.tracks))
+            if cost is not None:
+                log.debug("Shape of cost matrix C: %s", cost.shape)
+            log.debug("Assignment vector: %s", assignment)
 
         # Update KalmanFilter state, lastResults and tracks trace
 
         for i in range(len(self.tracks)):
-            if i in del_tracks:
-                continue
-            if predicted_classes is not None:
-                if i not in un_assigned_tracks:
+            if use_class:
+                if assignment[i] != -1:
                     self.tracks[i].predicted_class.append(predicted_classes[assignment[i]])
                 else:
                     self.tracks[i].predicted_class.append("")
-            if any(bounding_boxes) is not None:
-                if i not in un_assigned_tracks:
+            if use_bbox:
+                if assignment[i] != -1:
                     self.tracks[i].bbox_trace.append(bounding_boxes[assignment[i]])
                 else:
                     # if no new detection could be found, use the bounding box shape of the previous frame
@@ -260,19 +483,17 @@ class Tracker(object):
 
                 if assignment[i] != -1:
                     self.tracks[i].skipped_frames = 0
+                    # pass a view into the preconverted detection array, so the
+                    # filter does not have to re-parse a nested list per call
                     self.tracks[i].prediction = self.tracks[i].KF.update(
-                        detections[assignment[i]], 1)
+                        det_xy[assignment[i]], 1)
                 else:
                     if len(self.tracks[i].trace) > 1:
                         self.tracks[i].prediction = self.tracks[i].KF.update(
                             np.array([[0], [0]]), 0)
 
-                if len(self.tracks[i].trace) > self.max_trace_length:
-                    for j in range(len(self.tracks[i].trace) -
-                                   self.max_trace_length):
-                        del self.tracks[i].trace[j]
-
-                self.tracks[i].trace.append(self.tracks[i].prediction[:2])
+                # snapshot the prediction as an (x,y) column, as the flat view is overwritten in-place
+                self.tracks[i].trace.append(self.tracks[i].prediction.reshape(2, 1).copy())
                 self.tracks[i].KF.lastResult = self.tracks[i].prediction
 
             else:
@@ -281,11 +502,7 @@ class Tracker(object):
                 # unmatched tracks will retain the same state as at t-1
                 if assignment[i] != -1:
                     self.tracks[i].skipped_frames = 0
-                    self.tracks[i].prediction = detections[assignment[i]]
-
-                if len(self.tracks[i].trace) > self.max_trace_length:
-                    for j in range(len(self.tracks[i].trace) -
-                                   self.max_trace_length):
-                        del self.tracks[i].trace[j]
+                    self.tracks[i].prediction = det_xy[assignment[i]]
 
-                self.tracks[i].trace.append(self.tracks[i].prediction[:2])
+                # snapshot the prediction as an (x,y) column, as the flat view is overwritten in-place
+                self.tracks[i].trace.append(self.tracks[i].prediction.reshape(2, 1).copy())
@@ -145,7 +145,7 @@ class YoloTracker:
         # clear the tracker trace to ensure existing tracks are not overwritten
         if self.continue_tracking:
             for track in self.tracker_KF.tracks:
-                track.trace = []
+                track.trace.clear()
 
         # and produce an output file
         if export_video: